@@ -1,14 +1,18 @@
 import collections
 import getopt
+import hashlib
 import heapq
+import itertools
 import logging
 import math
 import multiprocessing
 import os
 import pickle
+import random
 import shutil
 import sys
 import utility
+import zlib
 
 # Set none for max processes
 PROCESS_COUNT = None
@@ -20,6 +24,22 @@ CONTENT_KEY = 'content'
 NGRAM_KEYS = ['unigram', 'bigram']
 FILE_BLACKLIST = set(['3074605.xml', '3074613.xml'])
 LENGTHS_PATH = 'lengths.txt'
+METADATA_PATH = 'metadata.txt'
+# Stopword and punctuation snapshot loaded by search.py instead of the nltk corpus
+NLP_PATH = 'nlp.txt'
+# Document fields indexed as per-value document bitmaps for search filters
+FILTER_KEYS = ['court', 'areaoflaw']
+# Document field indexed as a sorted column for date range filters
+DATE_KEY = 'date_posted'
+# Mapping of reassigned document IDs back to the original document IDs, only written when reordering
+DOC_IDS_PATH = 'docids.txt'
+# Number of MinHash functions used to cluster similar documents when reordering document IDs
+MINHASH_SIGNATURE_SIZE = 4
+MINHASH_PRIME = (1 << 61) - 1
+# Fixed seed so that every worker process draws the same MinHash functions
+MINHASH_SEED = 1
+minhash_random = random.Random(MINHASH_SEED)
+MINHASH_PARAMETERS = [(minhash_random.randrange(1, MINHASH_PRIME), minhash_random.randrange(MINHASH_PRIME)) for i in range(MINHASH_SIGNATURE_SIZE)]
 
 def get_length(counted_tokens):
 	"""
@@ -75,6 +95,57 @@ def get_block_path(tag, block_number):
 		os.makedirs(block_folder_path)
 	return os.path.join(block_folder_path, str(block_number) + BLOCK_EXT)
 
+def get_minhash_signature(counted_tokens):
+	"""
+	Calculate the MinHash signature of the set of terms of a document,
+	documents with similar term sets are likely to share signature prefixes
+
+	Args:
+		counted_tokens: dict of term:frequency items
+	
+	Returns:
+		A tuple of MINHASH_SIGNATURE_SIZE minimum hash values
+	"""
+	term_hashes = [zlib.crc32(term.encode('utf-8')) for term in counted_tokens]
+	if not term_hashes:
+		return (MINHASH_PRIME,) * MINHASH_SIGNATURE_SIZE
+	return tuple(min((a * term_hash + b) % MINHASH_PRIME for term_hash in term_hashes) for a, b in MINHASH_PARAMETERS)
+
+def get_gap_cost(doc_ids):
+	"""
+	Estimate the compressed size of a postings list as the Elias-gamma coded length of its doc ID gaps
+
+	Args:
+		doc_ids: Sorted list of document IDs
+	
+	Returns:
+		The estimated size in bits
+	"""
+	bits = 0
+	previous = -1
+	for doc_id in doc_ids:
+		bits += 2 * (doc_id - previous).bit_length() - 1
+		previous = doc_id
+	return bits
+
+def remap_postings(postings_list, doc_id_map):
+	""" Replace the document IDs of a postings list with reassigned IDs, keeping it sorted by document ID """
+	return sorted((doc_id_map[doc_id], freq,) for doc_id, freq in postings_list)
+
+def get_term_statistics(postings_list):
+	"""
+	Calculate the statistics of a term stored in the dictionary next to its postings offset,
+	so queries can be planned without reading the postings file
+
+	Args:
+		postings_list: List of (doc_id, term frequency) tuples
+	
+	Returns:
+		A tuple of the document frequency, collection frequency and maximum term frequency
+	"""
+	freqs = [freq for doc_id, freq in postings_list]
+	return len(freqs), sum(freqs), max(freqs)
+
 def deque_chunks(l, n):
 	chunks = []
 	""" Yield successive n-sized chunks from l. """
@@ -82,7 +153,7 @@ def deque_chunks(l, n):
 		chunks.append(collections.deque(l[i:i + n]))
 	return chunks
 
-def process_block(file_paths, block_number):
+def process_block(file_paths, block_number, fast_tokenizer=False, reorder_doc_ids=False):
 	"""
 	Preprocess a block defined by a number of file paths and a unique block identifier
 	and save them term-at-a-time to a temporary block file.
@@ -90,10 +161,14 @@ def process_block(file_paths, block_number):
 	Args:
 		file_paths: List of document file paths assigned to the block
 		block_number: Unique identifier for the block
+		fast_tokenizer: Use the fused single-pass regex tokenizer instead of the nltk pipeline
+		reorder_doc_ids: Also save the MinHash signature of each document for document ID reassignment
 	"""
 	logging.info('Processing block #%s', block_number)
 	block_index = {key:{} for key in NGRAM_KEYS}
 	block_lengths = {key:{} for key in NGRAM_KEYS}
+	block_metadata = {}
+	block_signatures = {}
 	i = 0
 	while(len(file_paths)):
 		file_path = file_paths.popleft()
@@ -103,27 +178,38 @@ def process_block(file_paths, block_number):
 		doc = utility.extract_doc(file_path)
 		logging.debug('[%s,%s] Removing CSS elements', block_number, i)
 		doc[CONTENT_KEY] = utility.remove_css_text(doc[CONTENT_KEY])
-		logging.debug('[%s,%s] Tokenizing document', block_number, i)
-		doc[CONTENT_KEY] = utility.tokenize(doc[CONTENT_KEY])
-		logging.debug('[%s,%s] Removing punctuations', block_number, i)
-		doc[CONTENT_KEY] = utility.remove_punctuations(doc[CONTENT_KEY])
-		logging.debug('[%s,%s] Removing stopwords', block_number, i)
-		doc[CONTENT_KEY] = utility.remove_stopwords(doc[CONTENT_KEY])
-		logging.debug('[%s,%s] Stemming tokens', block_number, i)
-		doc[CONTENT_KEY] = utility.stem(doc[CONTENT_KEY])
-		for k, ngram_key in enumerate(NGRAM_KEYS):
-			n = k + 1
-			doc_id = int(doc['document_id'])
-			logging.debug('[%s,%s] Generating %ss', block_number, i, ngram_key)
-			doc[ngram_key] = utility.generate_ngrams(doc[CONTENT_KEY], n)
-			logging.debug('[%s,%s] Counting %ss', block_number, i, ngram_key)
-			doc[ngram_key] = utility.count_tokens(doc[ngram_key])
+		doc_id = int(doc['document_id'])
+		block_metadata[doc_id] = {key: doc.get(key) for key in FILTER_KEYS + [DATE_KEY]}
+		if fast_tokenizer:
+			logging.debug('[%s,%s] Tokenizing and counting %ss in a single pass', block_number, i, '/'.join(NGRAM_KEYS))
+			counted_ngrams = utility.count_unigrams_bigrams(utility.fast_preprocess(doc[CONTENT_KEY]))
+			for ngram_key, counted_tokens in zip(NGRAM_KEYS, counted_ngrams):
+				doc[ngram_key] = counted_tokens
+		else:
+			logging.debug('[%s,%s] Tokenizing document', block_number, i)
+			doc[CONTENT_KEY] = utility.tokenize(doc[CONTENT_KEY])
+			logging.debug('[%s,%s] Removing punctuations', block_number, i)
+			doc[CONTENT_KEY] = utility.remove_punctuations(doc[CONTENT_KEY])
+			logging.debug('[%s,%s] Removing stopwords', block_number, i)
+			doc[CONTENT_KEY] = utility.remove_stopwords(doc[CONTENT_KEY])
+			logging.debug('[%s,%s] Stemming tokens', block_number, i)
+			doc[CONTENT_KEY] = utility.stem(doc[CONTENT_KEY])
+			for k, ngram_key in enumerate(NGRAM_KEYS):
+				n = k + 1
+				logging.debug('[%s,%s] Generating %ss', block_number, i, ngram_key)
+				doc[ngram_key] = utility.generate_ngrams(doc[CONTENT_KEY], n)
+				logging.debug('[%s,%s] Counting %ss', block_number, i, ngram_key)
+				doc[ngram_key] = utility.count_tokens(doc[ngram_key])
+		for ngram_key in NGRAM_KEYS:
 			logging.debug('[%s,%s] Processing %s postings and lengths', block_number, i, ngram_key)
 			block_lengths[ngram_key][doc_id] = get_length(doc[ngram_key])
 			for term, freq in doc[ngram_key].items():
 				if term not in block_index[ngram_key]:
 					block_index[ngram_key][term] = []
 				block_index[ngram_key][term].append((doc_id, freq,))
+		if reorder_doc_ids:
+			logging.debug('[%s,%s] Calculating MinHash signature', block_number, i)
+			block_signatures[doc_id] = get_minhash_signature(doc[NGRAM_KEYS[0]])
 		i += 1
 
 	logging.info('Saving block #%s', block_number)
@@ -140,10 +226,79 @@ def process_block(file_paths, block_number):
 
 		with open(block_lengths_path, 'wb') as f:
 			utility.save_object(block_lengths[ngram_key], f)
+
+	logging.debug('[%s] Saving metadata block', block_number)
+	with open(get_block_path('metadata', block_number), 'wb') as f:
+		utility.save_object(block_metadata, f)
+
+	if reorder_doc_ids:
+		logging.debug('[%s] Saving signatures block', block_number)
+		with open(get_block_path('signatures', block_number), 'wb') as f:
+			utility.save_object(block_signatures, f)
 	logging.info('Block #%s complete', block_number)
 
+def get_doc_id_order(signatures):
+	"""
+	Order documents so that documents with similar content are adjacent, by sorting on MinHash signatures
+
+	Args:
+		signatures: dict of doc_id:MinHash signature items
+	
+	Returns:
+		List of original document IDs, the index of each is its reassigned document ID
+	"""
+	return sorted(signatures, key=lambda doc_id: (signatures[doc_id], doc_id))
+
+def build_filter_indexes(metadata):
+	"""
+	Build the metadata filter indexes from the metadata of every document
+
+	Args:
+		metadata: dict of doc_id:{field:value} items, list values are indexed per element
+
+	Returns:
+		A tuple of a dict of field:{normalized value:Bitmap} items and the date column,
+		a tuple of the sorted dates and the document IDs posted on each date
+	"""
+	filter_indexes = {key:{} for key in FILTER_KEYS}
+	# Ascending document IDs take the bitmap append fast path
+	for doc_id in sorted(metadata):
+		for key in FILTER_KEYS:
+			values = metadata[doc_id].get(key)
+			if values is None:
+				continue
+			for value in values if isinstance(values, list) else [values]:
+				value = utility.normalize_filter_value(value)
+				if value not in filter_indexes[key]:
+					filter_indexes[key][value] = utility.Bitmap()
+				filter_indexes[key][value].add(doc_id)
+
+	date_doc_pairs = sorted((fields[DATE_KEY], doc_id) for doc_id, fields in metadata.items() if fields.get(DATE_KEY))
+	date_column = ([date for date, doc_id in date_doc_pairs], [doc_id for date, doc_id in date_doc_pairs])
+	return filter_indexes, date_column
+
+def get_index_version(paths):
+	"""
+	Calculate the index version as a checksum over the contents of the index files,
+	used by search.py to invalidate cached query results when the index changes
+
+	Args:
+		paths: List of index file paths
+	
+	Returns:
+		The hexadecimal MD5 digest of the concatenated index files
+	"""
+	checksum = hashlib.md5()
+	for path in paths:
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				checksum.update(chunk)
+	return checksum.hexdigest()
+
 def usage():
-	print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file -l lengths-file")
+	print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-f] [-r]")
+	print("  -f  use the fast single-pass tokenizer instead of nltk word_tokenize")
+	print("  -r  reassign document IDs so that documents with similar content are adjacent")
 
 def main():
 	logging.info('[Multi-Process Single Pass In-Memory Indexer]')
@@ -152,11 +307,20 @@ def main():
 		os.remove(dict_path)
 		os.remove(postings_path)
 		os.remove(LENGTHS_PATH)
+		os.remove(METADATA_PATH)
+		os.remove(DOC_IDS_PATH)
+		os.remove(NLP_PATH)
 	except OSError:
 		pass
 
 	logging.info('Using block size of %s', BLOCK_SIZE)
+	logging.info('Using %s tokenizer', 'fast' if fast_tokenizer else 'nltk')
+	logging.info('Document ID reassignment is %s', 'enabled' if reorder_doc_ids else 'disabled')
 	logging.info('Peak memory consumption is estimated to be: {:,.2f}GB'.format(0.00125*BLOCK_SIZE*multiprocessing.cpu_count()))
+	# Also loads the stopwords once before the workers are forked
+	logging.info('Saving stopword and punctuation snapshot')
+	utility.save_nlp_snapshot(NLP_PATH)
+
 	dict_file = open(dict_path, 'wb')
 	lengths_file = open(LENGTHS_PATH, 'wb')
 	postings_file = open(postings_path, 'wb')
@@ -172,8 +336,27 @@ def main():
 		block_count = len(filepath_blocks)
 
 		logging.info('Begin indexing')
-		with multiprocessing.Pool(PROCESS_COUNT) as pool:
-			pool.starmap(process_block, zip(filepath_blocks, range(block_count)))
+		# Workers read the stopwords from the snapshot whatever the start method, instead of loading the nltk corpus
+		with multiprocessing.Pool(PROCESS_COUNT, utility.load_nlp_snapshot, (NLP_PATH,)) as pool:
+			pool.starmap(process_block, zip(filepath_blocks, range(block_count), itertools.repeat(fast_tokenizer), itertools.repeat(reorder_doc_ids)))
+
+	doc_id_map = None
+	if reorder_doc_ids:
+		logging.info('Reassigning document IDs')
+		signatures = {}
+		for dirpath, dirnames, filenames in os.walk(get_block_folder_path('signatures')):
+			for filename in filenames:
+				if filename.endswith(BLOCK_EXT):
+					with open(os.path.join(dirpath, filename), 'rb') as f:
+						signatures.update(utility.load_object(f))
+		original_doc_ids = get_doc_id_order(signatures)
+		doc_id_map = {doc_id: new_doc_id for new_doc_id, doc_id in enumerate(original_doc_ids)}
+		# Dense document IDs in filename order, so the size comparison isolates the effect of clustering
+		baseline_doc_id_map = {doc_id: new_doc_id for new_doc_id, doc_id in enumerate(sorted(signatures))}
+		with open(DOC_IDS_PATH, 'wb') as f:
+			utility.save_object(original_doc_ids, f)
+		# Estimated gamma coded postings size in bits, with dense document IDs in filename and clustered order
+		baseline_gap_cost = reordered_gap_cost = 0
 
 	# Block merging step
 	logging.info('Merging blocks')
@@ -195,7 +378,11 @@ def main():
 				# Save current pair to file if next term in lexicographical order is different
 				# Also buffer next pair for future comparison cycles
 				if target_term != term:
-					utility.save_object((target_term, size), dict_file)
+					if doc_id_map is not None:
+						baseline_gap_cost += get_gap_cost(sorted(baseline_doc_id_map[doc_id] for doc_id, freq in target_postings_list))
+						target_postings_list = remap_postings(target_postings_list, doc_id_map)
+						reordered_gap_cost += get_gap_cost([doc_id for doc_id, freq in target_postings_list])
+					utility.save_object((target_term, size) + get_term_statistics(target_postings_list), dict_file)
 					size = utility.save_object(target_postings_list, postings_file)
 					target_term = term
 					target_postings_list = postings_list
@@ -203,10 +390,14 @@ def main():
 				# Merge duplicate pairs from heap, in memory buffer
 					target_postings_list.extend(postings_list)
 			# Save last pair buffered in memory as no subsequent pairs exist 
-			utility.save_object((target_term, size), dict_file)
+			if doc_id_map is not None:
+				baseline_gap_cost += get_gap_cost(sorted(baseline_doc_id_map[doc_id] for doc_id, freq in target_postings_list))
+				target_postings_list = remap_postings(target_postings_list, doc_id_map)
+				reordered_gap_cost += get_gap_cost([doc_id for doc_id, freq in target_postings_list])
+			utility.save_object((target_term, size) + get_term_statistics(target_postings_list), dict_file)
 			size = utility.save_object(target_postings_list, postings_file)
 			# Save a marker in dictionary between models
-			utility.save_object((None, None), dict_file)
+			utility.save_object((None, None, None, None, None), dict_file)
 
 			# Cleanup index file handles
 			for block_file_handle in block_file_handles:
@@ -220,8 +411,26 @@ def main():
 				if filename.endswith(BLOCK_EXT):
 					with open(os.path.join(dirpath, filename), 'rb') as f:
 						lengths.update(utility.load_object(f))
+			if doc_id_map is not None:
+				lengths = {doc_id_map[doc_id]: length for doc_id, length in lengths.items()}
 			utility.save_object(lengths, lengths_file)
 
+	logging.info('Building metadata filter indexes')
+	metadata = {}
+	for dirpath, dirnames, filenames in os.walk(get_block_folder_path('metadata')):
+		for filename in filenames:
+			if filename.endswith(BLOCK_EXT):
+				with open(os.path.join(dirpath, filename), 'rb') as f:
+					metadata.update(utility.load_object(f))
+	if doc_id_map is not None:
+		metadata = {doc_id_map[doc_id]: fields for doc_id, fields in metadata.items()}
+	filter_indexes, date_column = build_filter_indexes(metadata)
+	for key in FILTER_KEYS:
+		logging.info('Indexed %s distinct %s values', len(filter_indexes[key]), key)
+	with open(METADATA_PATH, 'wb') as f:
+		utility.save_object(filter_indexes, f)
+		utility.save_object(date_column, f)
+
 	logging.info('Cleaning up blocks')
 	# Cleanup block files
 	shutil.rmtree(get_block_folder_path())
@@ -229,13 +438,20 @@ def main():
 	dict_file.close()
 	lengths_file.close()
 	postings_file.close()
+
+	if doc_id_map is not None:
+		# The postings file stores pickled absolute document IDs, so these sizes are an estimate of a gap coded index
+		logging.info('Estimated gamma coded postings size with document IDs in filename order: {:,}B (estimate, postings.txt is not gap coded)'.format(baseline_gap_cost // 8))
+		logging.info('Estimated gamma coded postings size with clustered document IDs: {:,}B ({:+.1%}, estimate, postings.txt is not gap coded)'.format(reordered_gap_cost // 8, reordered_gap_cost / baseline_gap_cost - 1 if baseline_gap_cost else 0))
+	logging.info('Postings size: {:,}B'.format(os.path.getsize(postings_path)))
 	logging.info('Indexing complete')
 
 if __name__ == '__main__':
 	logging.basicConfig(level=logging.INFO, datefmt='%d/%m %H:%M:%S', format='%(asctime)s %(message)s')
 	dir_doc = dict_path = postings_path = None
+	fast_tokenizer = reorder_doc_ids = False
 	try:
-		opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
+		opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:fr')
 	except getopt.GetoptError as err:
 		usage()
 		sys.exit(2)
@@ -246,6 +462,10 @@ if __name__ == '__main__':
 			dict_path = a
 		elif o == '-p':
 			postings_path = a
+		elif o == '-f':
+			fast_tokenizer = True
+		elif o == '-r':
+			reorder_doc_ids = True
 		else:
 			assert False, "unhandled option"
 	if dir_doc == None or dict_path == None or postings_path == None:
@@ -254,6 +474,10 @@ if __name__ == '__main__':
 
 	dir_doc += '/' if not dir_doc.endswith('/') else ''
 
-	utility.save_config({'dir_doc': dir_doc, 'dict_path': dict_path, 'postings_path': postings_path, 'lengths_path': LENGTHS_PATH})
-
 	main()
+
+	logging.info('Calculating index version')
+	index_paths = [dict_path, postings_path, LENGTHS_PATH, METADATA_PATH, NLP_PATH] + ([DOC_IDS_PATH] if reorder_doc_ids else [])
+	index_version = get_index_version(index_paths)
+	logging.info('Index version is %s', index_version)
+	utility.save_config({'dir_doc': dir_doc, 'dict_path': dict_path, 'postings_path': postings_path, 'lengths_path': LENGTHS_PATH, 'metadata_path': METADATA_PATH, 'nlp_path': NLP_PATH, 'doc_ids_path': DOC_IDS_PATH if reorder_doc_ids else None, 'fast_tokenizer': fast_tokenizer, 'index_version': index_version})
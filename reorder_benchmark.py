@@ -0,0 +1,79 @@
+import getopt
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Number of search runs per index, the median total query latency is reported
+RUNS = 5
+QUERY_LATENCY_REGEX = re.compile(r"Query .* took ([0-9.]+) seconds")
+# The gamma coded size estimates compare dense IDs in filename and clustered order, isolating the clustering,
+# while the pickled postings size and query latency compare against the original sparse document IDs
+GAP_COST_REGEX = re.compile(r"Estimated gamma coded postings size .*")
+
+def build_index(work_dir, extra_args):
+	""" Index the documents into work_dir and return the indexer log """
+	script_dir = os.path.dirname(os.path.realpath(__file__))
+	args = [sys.executable, os.path.join(script_dir, 'index.py'), '-i', dir_doc, '-d', 'dictionary.txt', '-p', 'postings.txt'] + extra_args
+	return subprocess.run(args, cwd=work_dir, stderr=subprocess.PIPE, check=True).stderr.decode()
+
+def time_queries(work_dir):
+	""" Median over RUNS uncached search runs of the total query latency in seconds """
+	script_dir = os.path.dirname(os.path.realpath(__file__))
+	args = [sys.executable, os.path.join(script_dir, 'search.py'), '-d', 'dictionary.txt', '-p', 'postings.txt', '-q', query_path, '-o', 'output.txt']
+	timings = []
+	for i in range(RUNS):
+		# Every run must evaluate the queries, not read them from the persisted query cache
+		cache_path = os.path.join(work_dir, 'query_cache.tmp')
+		if os.path.exists(cache_path):
+			os.remove(cache_path)
+		log = subprocess.run(args, cwd=work_dir, stderr=subprocess.PIPE, check=True).stderr.decode()
+		timings.append(sum(float(latency) for latency in QUERY_LATENCY_REGEX.findall(log)))
+	return sorted(timings)[len(timings) // 2]
+
+def main():
+	results = {}
+	for name, extra_args in (('original document IDs', index_args), ('clustered document IDs', index_args + ['-r'])):
+		work_dir = tempfile.mkdtemp()
+		try:
+			log = build_index(work_dir, extra_args)
+			for line in GAP_COST_REGEX.findall(log):
+				print(line)
+			postings_size = os.path.getsize(os.path.join(work_dir, 'postings.txt'))
+			results[name] = (postings_size, time_queries(work_dir))
+		finally:
+			shutil.rmtree(work_dir)
+
+	baseline_size, baseline_latency = results['original document IDs']
+	print('The gamma coded sizes above are estimates, postings.txt stores pickled absolute document IDs and is measured below')
+	for name, (postings_size, latency) in results.items():
+		print('{}: postings {:,}B ({:+.1%}), queries {:.4f}s ({:+.1%})'.format(name, postings_size, postings_size / baseline_size - 1, latency, latency / baseline_latency - 1 if baseline_latency else 0))
+
+def usage():
+	print("usage: " + sys.argv[0] + " -i directory-of-documents -q file-of-queries [-f]")
+	print("  -f  index with the fast single-pass tokenizer")
+
+if __name__ == '__main__':
+	dir_doc = query_path = None
+	index_args = []
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'i:q:f')
+	except getopt.GetoptError as err:
+		usage()
+		sys.exit(2)
+	for o, a in opts:
+		if o == '-i':
+			dir_doc = os.path.abspath(a)
+		elif o == '-q':
+			query_path = os.path.abspath(a)
+		elif o == '-f':
+			index_args.append('-f')
+		else:
+			assert False, "unhandled option"
+	if dir_doc == None or query_path == None:
+		usage()
+		sys.exit(2)
+
+	main()
@@ -3,7 +3,12 @@ import sys
 import utility
 import math
 import heapq
+import logging
 import os
+import re
+import time
+from bisect import bisect_left
+from bisect import bisect_right
 from utility import ScoreDocIDPair
 from utility import ScoreTermPair
 from functools import reduce
@@ -13,8 +18,30 @@ bigram_dict = {}
 unigram_lengths = {}
 bigram_lengths = {}
 
+# Metadata filter indexes, field:{normalized value:Bitmap}, and the date column, (sorted dates, doc_ids)
+filter_indexes = {}
+date_column = ([], [])
+
+# Original document IDs indexed by reassigned document ID, None if the index kept the original document IDs
+original_doc_ids = None
+
+# Time by which the current query must finish under QUERY_LATENCY_BUDGET, None if there is no budget
+query_deadline = None
+
+# Whether vsm skipped query terms for the current query because the latency budget ran out
+query_truncated = False
+
+# Set of the documents allowed by the filter clauses of the current query, None if the query is unfiltered
+doc_filter = None
+
 doc_query_cache = {}
 
+# Cache of final query results keyed by the normalized query, None when QUERY_CACHE_SIZE disables caching
+query_cache = None
+
+# Whether the index was built with the fast single-pass tokenizer, queries must be preprocessed identically
+fast_tokenizer = False
+
 # Maximum number of documents used to run the query expansion
 QUERY_EXPANSION_DOCUMENT_LIMIT = 10
 
@@ -24,22 +51,50 @@ QUERY_EXPANSION_KEYWORD_LIMIT = 10
 # Number of times the bigram terms from the initial query is appended the list of extracted keywords
 QUERY_ENHANCE = 10
 
+# Filter clauses of the form field:value or field:"value", dates take a start..end range with either end optional
+FILTER_CLAUSE_REGEX = re.compile(r'^\s*(court|areaoflaw|date)\s*:\s*"?([^"]*)"?\s*$')
+DATE_RANGE_SEPARATOR = '..'
+
+# Maximum number of query results kept in the query cache, least recently used results are evicted first.
+# 0 disables the query cache and its persistence
+QUERY_CACHE_SIZE = 1000
+
+# Seconds a cached query result stays valid, None for no expiry
+QUERY_CACHE_TTL = None
+
+# Query cache persistence path, None to keep the cache in memory only
+QUERY_CACHE_PATH = 'query_cache.tmp'
+
+# Query terms with a lower idf are dropped by the query planner without reading their postings, None keeps every term
+QUERY_MIN_IDF = None
+
+# Seconds a whole query may take, shared by every vsm call it makes for its phrases and its expansion.
+# Once the budget runs out, vsm skips the remaining planned terms and the result is approximate.
+# The highest impact terms are evaluated first and each vsm call always evaluates at least one term.
+# None for no budget
+QUERY_LATENCY_BUDGET = None
+
 
 # Given a File object and load unigram dictionary and bigram dictionary
 def load_dicts(dict_file):
 	dicts = []
 	current_dict = {}
 	offset = 0
-	for term, diff in utility.objects_in(dict_file):
+	for term, diff, df, cf, max_tf in utility.objects_in(dict_file):
 		if term is None and diff is None:
 			dicts.append(current_dict)
 			current_dict = {}
 		else:
 			offset += diff
-			current_dict[term] = {'offset': offset}
+			current_dict[term] = {'offset': offset, 'df': df, 'cf': cf, 'max_tf': max_tf}
 	return tuple(dicts)
 
 
+# Given a document ID from the index, return the original document ID, which also names the document file
+def get_original_doc_id(doc_id):
+	return original_doc_ids[doc_id] if original_doc_ids is not None else doc_id
+
+
 # Given term and unigram/bigram dictionary, return postings of the term if exists
 def get_posting(term, dictionary):
 	postings_file.seek(dictionary[term]['offset'])
@@ -56,6 +111,8 @@ def strip_and_preprocess(line):
 
 # Tokenize a string, remove punctuations and stopwords, then stem each token. Return a list of stemmed words
 def preprocess(line):
+	if fast_tokenizer:
+		return list(utility.fast_preprocess(line))
 	line = utility.tokenize(line)
 	line = utility.remove_punctuations(line)
 	line = utility.remove_stopwords(line)
@@ -63,25 +120,54 @@ def preprocess(line):
 	return line
 
 
-# Given n-grams with count, unigram/bigram dictionary, unigram/bigram lengths (euclidean norm of documents)
-# and top_k which indicate the number of desired documents in the final result.
-# This method evaluate using vector space model LNC.LTC and return a list of ScoreDocIDPair
-def vsm(query_ngrams, dictionary, lengths, top_k=sys.maxsize):
-	scores = {}
+# Given term and unigram/bigram dictionary and unigram/bigram lengths, return the idf of the term from its dictionary entry
+def get_idf(term, dictionary, lengths):
+	return math.log10(len(lengths) / dictionary[term]['df'])
+
+
+# Given n-grams with count, unigram/bigram dictionary and unigram/bigram lengths, plan the evaluation of the query
+# from the dictionary statistics only. Return the query weights of every term in the dictionary, for the query norm,
+# and a list of (term, idf, query_tf_weight) to evaluate ordered by decreasing upper bound of the score contribution,
+# idf * query_tf_weight * doc_tf_weight of the maximum term frequency. Terms with idf below QUERY_MIN_IDF are dropped.
+def plan_query(query_ngrams, dictionary, lengths):
 	query_weights = []
+	plan = []
 	for term, query_tf in query_ngrams.items():
 		if term in dictionary:
-			# print('term in dict')
-			postings_entry = get_posting(term, dictionary)
-			# print('posting entry', postings_entry)
-			idf = math.log10(len(lengths) / len(postings_entry))
+			idf = get_idf(term, dictionary, lengths)
 			query_tf_weight = 1 + math.log10(query_tf)
-			for doc_id, doc_tf in postings_entry:
-				doc_tf_weight = 1 + math.log10(doc_tf)
-				if doc_id not in scores:
-					scores[doc_id] = 0
-				scores[doc_id] += doc_tf_weight * idf * query_tf_weight
 			query_weights.append(idf * query_tf_weight)
+			if QUERY_MIN_IDF is None or idf >= QUERY_MIN_IDF:
+				plan.append((term, idf, query_tf_weight))
+	plan.sort(key=lambda x: -x[1] * x[2] * (1 + math.log10(dictionary[x[0]]['max_tf'])))
+	return query_weights, plan
+
+
+# Given n-grams with count, unigram/bigram dictionary, unigram/bigram lengths (euclidean norm of documents)
+# and top_k which indicate the number of desired documents in the final result.
+# This method evaluate using vector space model LNC.LTC and return a list of ScoreDocIDPair
+def vsm(query_ngrams, dictionary, lengths, top_k=sys.maxsize):
+	global query_truncated
+
+	scores = {}
+	# No postings can overlap an empty filter
+	if doc_filter is not None and not doc_filter:
+		return []
+	query_weights, plan = plan_query(query_ngrams, dictionary, lengths)
+	for i, (term, idf, query_tf_weight) in enumerate(plan):
+		if query_deadline is not None and i > 0 and time.time() > query_deadline:
+			logging.debug('Latency budget exceeded, skipping %s of %s query terms', len(plan) - i, len(plan))
+			query_truncated = True
+			break
+		postings_entry = get_posting(term, dictionary)
+		# Pre-filter, intersect the postings with the filter once so excluded documents are never scored
+		if doc_filter is not None:
+			postings_entry = [posting for posting in postings_entry if posting[0] in doc_filter]
+		for doc_id, doc_tf in postings_entry:
+			doc_tf_weight = 1 + math.log10(doc_tf)
+			if doc_id not in scores:
+				scores[doc_id] = 0
+			scores[doc_id] += doc_tf_weight * idf * query_tf_weight
 
 	query_l2_norm = math.sqrt(sum([math.pow(query_weight, 2) for query_weight in query_weights]))
 
@@ -106,7 +192,7 @@ def turn_query_into_ngram(phrase, n):
 # #DEPRECATED Initially we do query expansion using the whole document content as a query.
 # This method return a list of ranked document ids
 def query_with_doc(doc_id):
-	file_path = os.path.join(dir_doc, str(doc_id) + '.xml')
+	file_path = os.path.join(dir_doc, str(get_original_doc_id(doc_id)) + '.xml')
 	if doc_id in doc_query_cache:
 		pass
 	elif os.path.isfile(file_path):
@@ -132,12 +218,14 @@ def query_with_bigram_keywords(keywords):
 # preprocess it into a list of stemmed words, then convert it into n-grams with counts, N.
 # Walk through all the terms in the n-grams, assign a score with formula
 # 	[TERM_FREQ_IN_N] * [INV_DOC_FREQ_OF_CORPUS] * [DOC_FREQ_OF_TERM_IN_N].
+# Terms are visited in decreasing order of an upper bound of their score computed from the dictionary alone,
+# postings are only read until no remaining term can enter the top keywords.
 # Return top QUERY_EXPANSION_KEYWORD_LIMIT number of keywords.
 def extract_keywords_from_docs(doc_ids):
 	result = []
 	combined_doc = ''
 	for doc_id in doc_ids:
-		file_path = os.path.join(dir_doc, str(doc_id) + '.xml')
+		file_path = os.path.join(dir_doc, str(get_original_doc_id(doc_id)) + '.xml')
 		if os.path.isfile(file_path):
 			doc_content = utility.extract_doc(file_path).get('content')
 			combined_doc += doc_content + ' '
@@ -147,18 +235,29 @@ def extract_keywords_from_docs(doc_ids):
 	combined_doc = preprocess(combined_doc)
 	query_ngrams = turn_query_into_ngram(combined_doc, 2)
 
+	candidates = []
 	for term, query_tf in query_ngrams.items():
-		# negative score as the heapq is a min heap, replace doc id to term in this case
 		if term in bigram_dict:
-			postings_entry = get_posting(term, bigram_dict)
-			query_df = sum([1 if is_doc_id_in_postings(doc_id, postings_entry) else 0 for doc_id in doc_ids]) / QUERY_EXPANSION_DOCUMENT_LIMIT
-			idf = math.log10(len(bigram_lengths) / len(postings_entry))
-			tfidf = (1 + math.log10(query_tf)) * idf * query_df
-			result.append(ScoreTermPair(-tfidf, term))
-
-	heapq.heapify(result)
-
-	return [heapq.heappop(result).term for i in range(min(QUERY_EXPANSION_KEYWORD_LIMIT, len(result)))]
+			idf = get_idf(term, bigram_dict, bigram_lengths)
+			tf_idf = (1 + math.log10(query_tf)) * idf
+			# The term occurs in at most df of the documents
+			max_query_df = min(len(doc_ids), bigram_dict[term]['df']) / QUERY_EXPANSION_DOCUMENT_LIMIT
+			candidates.append((tf_idf * max_query_df, tf_idf, term))
+	candidates.sort(key=lambda x: -x[0])
+
+	# min heap of the best scores so far, the weakest keyword is on top
+	for upper_bound, tf_idf, term in candidates:
+		if len(result) == QUERY_EXPANSION_KEYWORD_LIMIT and upper_bound < result[0].score:
+			break
+		postings_entry = get_posting(term, bigram_dict)
+		query_df = sum([1 if is_doc_id_in_postings(doc_id, postings_entry) else 0 for doc_id in doc_ids]) / QUERY_EXPANSION_DOCUMENT_LIMIT
+		pair = ScoreTermPair(tf_idf * query_df, term)
+		if len(result) < QUERY_EXPANSION_KEYWORD_LIMIT:
+			heapq.heappush(result, pair)
+		elif result[0] < pair:
+			heapq.heapreplace(result, pair)
+
+	return [pair.term for pair in sorted(result, reverse=True)]
 
 
 # Given a document ID and a postings list, check if the document ID appears in the postings list
@@ -211,7 +310,7 @@ def convert_phrases_into_bigrams(phrases):
 # Check whether the document has all the keywords. Return 0 if doesn't. 1 if has.
 # Return Integer for ease of sorting.
 def have_all_keywords(doc_id, keywords):
-	file_path = os.path.join(utility.load_config().get('dir_doc'), str(doc_id) + '.xml')
+	file_path = os.path.join(utility.load_config().get('dir_doc'), str(get_original_doc_id(doc_id)) + '.xml')
 	entities = utility.extract_doc(file_path)
 	doc_content = entities.get('content')
 	for keyword in keywords:
@@ -220,9 +319,14 @@ def have_all_keywords(doc_id, keywords):
 	return 1
 
 
+# Given a list of phrases, return the raw keywords matched against document content by sort_by_boolean_query
+def get_boolean_keywords(phrases):
+	return list(map(lambda x: x.strip('" '), phrases))
+
+
 # Sort boolean query ranking to prioritize documents with all the query keywords
 def sort_by_boolean_query(ranking, keywords):
-	keywords = list(map(lambda x: x.strip('" '), keywords))
+	keywords = get_boolean_keywords(keywords)
 	result = []
 	for pair in ranking:
 		doc_id = pair.doc_id
@@ -232,12 +336,64 @@ def sort_by_boolean_query(ranking, keywords):
 	return result
 
 
+# Given the phrases of a query, separate the filter clauses from the phrases.
+# Return the remaining phrases and a list of (field, value) filter clauses
+def split_filter_clauses(phrases):
+	remaining_phrases = []
+	clauses = []
+	for phrase in phrases:
+		match = FILTER_CLAUSE_REGEX.match(phrase)
+		if match:
+			clauses.append(match.groups())
+		else:
+			remaining_phrases.append(phrase)
+	return remaining_phrases, clauses
+
+
+# Given a date or a start..end date range, return a Bitmap of the documents posted within it.
+# Dates are compared as ISO 8601 prefixes, so 2015 covers the whole year.
+def get_date_range_bitmap(date_range):
+	start, separator, end = date_range.partition(DATE_RANGE_SEPARATOR)
+	start = start.strip()
+	end = end.strip() if separator else start
+	dates, doc_ids = date_column
+	low = bisect_left(dates, start) if start else 0
+	high = bisect_right(dates, end + '\uffff') if end else len(dates)
+	return utility.Bitmap.from_sorted(sorted(doc_ids[low:high]))
+
+
+# Given a list of (field, value) filter clauses, return a Bitmap of the documents satisfying all of them.
+# Clauses on the same field are unioned, clauses on different fields are intersected.
+# Return None if there are no filter clauses
+def build_doc_filter(clauses):
+	field_bitmaps = {}
+	for field, value in clauses:
+		if field == 'date':
+			bitmap = get_date_range_bitmap(value)
+		else:
+			bitmap = filter_indexes.get(field, {}).get(utility.normalize_filter_value(value), utility.Bitmap())
+		field_bitmaps[field] = field_bitmaps[field] | bitmap if field in field_bitmaps else bitmap
+	if not field_bitmaps:
+		return None
+	return reduce(lambda x, y: x & y, field_bitmaps.values())
+
+
 # Given original query string with ‘AND’, split it into multiple phrases.
 # Each phrase is evaluated with handle_phrasal_query(phrase).
 # Keywords are extracted using intermediate result, then used to make query expansion.
 # Final result is sorted against the occurrences of all original phrases.
+# Filter clauses restrict every evaluation to the matching documents.
 def handle_boolean_query(query):
-	phrases = query.split('AND')
+	global doc_filter
+
+	phrases, clauses = split_filter_clauses(query.split('AND'))
+	doc_filter = build_doc_filter(clauses)
+	if not phrases:
+		return iter(doc_filter) if doc_filter is not None else iter([])
+	# The bitmaps are combined container by container above, the final filter becomes a set
+	# once per query because it is probed once per posting
+	if doc_filter is not None:
+		doc_filter = set(doc_filter)
 
 	extracted_keyword_sets = []
 	for phrase in phrases:
@@ -255,11 +411,46 @@ def handle_boolean_query(query):
 	return map(lambda x: x.doc_id, final_ranking)
 
 
+# Given the phrases and filter clauses of a query, return its query cache key:
+# the preprocessed phrases in order, the raw keywords of the case-sensitive boolean re-sort,
+# the normalized filter clauses and the minimum idf of the query planner, as all of them change the result.
+# The latency budget is left out as results truncated by it are never cached
+def get_query_cache_key(phrases, clauses):
+	normalized_phrases = tuple(tuple(strip_and_preprocess(phrase)) for phrase in phrases)
+	boolean_keywords = tuple(get_boolean_keywords(phrases))
+	normalized_clauses = tuple((field, utility.normalize_filter_value(value)) for field, value in clauses)
+	return normalized_phrases, boolean_keywords, normalized_clauses, QUERY_MIN_IDF
+
+
+# Evaluate a query with handle_boolean_query(query), reusing the cached result of an identical normalized query.
+# The latency budget covers the whole query. Results truncated by it depend on timing and are not cached
+def handle_query(query):
+	global query_deadline, query_truncated
+
+	query_deadline = time.time() + QUERY_LATENCY_BUDGET if QUERY_LATENCY_BUDGET is not None else None
+	query_truncated = False
+	if query_cache is None:
+		return list(handle_boolean_query(query))
+	key = get_query_cache_key(*split_filter_clauses(query.split('AND')))
+	result = query_cache.get(key)
+	if result is None:
+		result = list(handle_boolean_query(query))
+		if not query_truncated:
+			query_cache.put(key, result)
+	return result
+
+
 def main():
 	global unigram_dict, bigram_dict
 	global unigram_lengths, bigram_lengths
+	global filter_indexes, date_column
+	global query_cache
+	global original_doc_ids
 	global postings_file
 
+	if nlp_path is not None and os.path.isfile(nlp_path):
+		utility.load_nlp_snapshot(nlp_path)
+
 	postings_file = open(postings_path, 'rb')
 
 	with open(dict_path, 'rb') as f:
@@ -269,14 +460,33 @@ def main():
 		unigram_lengths = utility.load_object(f)
 		bigram_lengths = utility.load_object(f)
 
+	if metadata_path is not None and os.path.isfile(metadata_path):
+		with open(metadata_path, 'rb') as f:
+			filter_indexes = utility.load_object(f)
+			date_column = utility.load_object(f)
+
+	if doc_ids_path is not None:
+		with open(doc_ids_path, 'rb') as f:
+			original_doc_ids = utility.load_object(f)
+
+	if QUERY_CACHE_SIZE > 0:
+		query_cache = utility.QueryCache.load(QUERY_CACHE_PATH, index_version, QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
 	result = []
 	with open(query_path, 'r') as f:
 		for line in f:
 			line = line.strip()
 			if line != '':
-				result = handle_boolean_query(line)
+				start = time.time()
+				result = handle_query(line)
+				logging.info('Query %r took %.4f seconds', line, time.time() - start)
+
+	if query_cache is not None:
+		logging.info('Query cache: %s', query_cache)
+		if QUERY_CACHE_PATH is not None:
+			query_cache.save(QUERY_CACHE_PATH)
 
-	output = ' '.join(list(map(lambda x: str(x), result)))
+	output = ' '.join(list(map(lambda x: str(get_original_doc_id(x)), result)))
 	with open(output_path, 'w') as f:
 		f.write(output)
 
@@ -287,6 +497,7 @@ def usage():
 	print("usage: " + sys.argv[0] + "-d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
 
 if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO, datefmt='%d/%m %H:%M:%S', format='%(asctime)s %(message)s')
 	dict_path = postings_path = query_path = output_path = None
 	try:
 		opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
@@ -310,6 +521,11 @@ if __name__ == '__main__':
 	dict_path = args.get('dict_path', dict_path)
 	postings_path = args.get('postings_path', postings_path)
 	lengths_path = args.get('lengths_path')
+	metadata_path = args.get('metadata_path')
+	doc_ids_path = args.get('doc_ids_path')
+	nlp_path = args.get('nlp_path')
+	index_version = args.get('index_version')
+	fast_tokenizer = args.get('fast_tokenizer', False)
 
 	if dict_path is None or postings_path is None or query_path is None or output_path is None:
 		usage()
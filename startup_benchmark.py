@@ -0,0 +1,92 @@
+import getopt
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import utility
+
+# Number of fresh interpreters started per measurement, the median is reported
+RUNS = 5
+SAMPLE_QUERY = '"loss of self-control"'
+
+# Each snippet runs in a fresh interpreter and prints the seconds it took
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import utility
+print(time.perf_counter() - start)
+"""
+
+FIRST_QUERY_SNIPPET = """
+import time
+start = time.perf_counter()
+import utility
+nlp_path, query, fast = {nlp_path!r}, {query!r}, {fast!r}
+if nlp_path is not None:
+	utility.load_nlp_snapshot(nlp_path)
+list(utility.fast_preprocess(query)) if fast else utility.stem(utility.remove_stopwords(utility.remove_punctuations(utility.tokenize(query))))
+print(time.perf_counter() - start)
+"""
+
+def preprocess_in_worker(query):
+	""" First preprocessing in a pool worker, as done by the first document of each index block """
+	import utility
+	start = time.perf_counter()
+	list(utility.fast_preprocess(query))
+	return time.perf_counter() - start
+
+def time_snippet(snippet):
+	""" Median seconds reported by a snippet over RUNS fresh interpreters """
+	script_dir = os.path.dirname(os.path.realpath(__file__))
+	timings = []
+	for i in range(RUNS):
+		output = subprocess.check_output([sys.executable, '-c', snippet], cwd=script_dir)
+		timings.append(float(output.decode().split()[-1]))
+	return sorted(timings)[len(timings) // 2]
+
+def time_worker_spawn(start_method, nlp_path):
+	""" Median seconds over RUNS to start a pool worker, as index.py does, and preprocess the first query in it """
+	context = multiprocessing.get_context(start_method)
+	initializer, initargs = (utility.load_nlp_snapshot, (nlp_path,)) if nlp_path is not None else (None, ())
+	timings = []
+	for i in range(RUNS):
+		start = time.perf_counter()
+		with context.Pool(1, initializer, initargs) as pool:
+			pool.apply(preprocess_in_worker, (SAMPLE_QUERY,))
+		timings.append(time.perf_counter() - start)
+	return sorted(timings)[len(timings) // 2]
+
+def main():
+	print('import utility: {:.4f}s'.format(time_snippet(IMPORT_SNIPPET)))
+	print('first query, nltk stopword corpus, fast tokenizer: {:.4f}s'.format(time_snippet(FIRST_QUERY_SNIPPET.format(nlp_path=None, query=SAMPLE_QUERY, fast=True))))
+	if nlp_path is not None:
+		print('first query, index snapshot, fast tokenizer: {:.4f}s'.format(time_snippet(FIRST_QUERY_SNIPPET.format(nlp_path=os.path.abspath(nlp_path), query=SAMPLE_QUERY, fast=True))))
+	if nltk_tokenizer:
+		print('first query, nltk stopword corpus, nltk tokenizer: {:.4f}s'.format(time_snippet(FIRST_QUERY_SNIPPET.format(nlp_path=None, query=SAMPLE_QUERY, fast=False))))
+	for start_method in multiprocessing.get_all_start_methods():
+		print('worker spawn and first preprocess, nltk stopword corpus ({}): {:.4f}s'.format(start_method, time_worker_spawn(start_method, None)))
+		if nlp_path is not None:
+			print('worker spawn and first preprocess, index snapshot ({}): {:.4f}s'.format(start_method, time_worker_spawn(start_method, os.path.abspath(nlp_path))))
+
+def usage():
+	print("usage: " + sys.argv[0] + " [-s nlp-snapshot-file] [-t]")
+	print("  -t  also time the nltk word_tokenize pipeline, requires the punkt models")
+
+if __name__ == '__main__':
+	nlp_path = None
+	nltk_tokenizer = False
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 's:t')
+	except getopt.GetoptError as err:
+		usage()
+		sys.exit(2)
+	for o, a in opts:
+		if o == '-s':
+			nlp_path = a
+		elif o == '-t':
+			nltk_tokenizer = True
+		else:
+			assert False, "unhandled option"
+
+	main()
@@ -0,0 +1,81 @@
+import index
+import random
+import search
+import utility
+from array import array
+
+METADATA = {
+	1: {'court': 'SG Court of Appeal', 'areaoflaw': ['Tort', 'Contract Law'], 'date_posted': '2014-12-31 00:00:00'},
+	2: {'court': 'SG High Court', 'areaoflaw': ['Contract Law'], 'date_posted': '2015-01-01 00:00:00'},
+	3: {'court': 'SG High Court', 'areaoflaw': 'Tort', 'date_posted': '2015-06-30 00:00:00'},
+	4: {'court': 'UK House of Lords', 'areaoflaw': None, 'date_posted': '2016-03-01 00:00:00'},
+	5: {'court': None, 'areaoflaw': ['Criminal Law'], 'date_posted': None},
+}
+
+def setup_filters(monkeypatch):
+	filter_indexes, date_column = index.build_filter_indexes(METADATA)
+	monkeypatch.setattr(search, 'filter_indexes', filter_indexes)
+	monkeypatch.setattr(search, 'date_column', date_column)
+
+def test_bitmap_add_contains_and_iteration():
+	bitmap = utility.Bitmap()
+	for doc_id in [70000, 5, 3, 5, 65535, 65536]:
+		bitmap.add(doc_id)
+	assert list(bitmap) == [3, 5, 65535, 65536, 70000]
+	assert len(bitmap) == 5
+	assert 65536 in bitmap and 5 in bitmap
+	assert 4 not in bitmap and 131072 not in bitmap
+
+def test_bitmap_switches_to_bitset_above_array_limit():
+	bitmap = utility.Bitmap(range(0, 2 * utility.Bitmap.ARRAY_CONTAINER_MAX, 2))
+	assert isinstance(bitmap.containers[0], array)
+	bitmap.add(2 * utility.Bitmap.ARRAY_CONTAINER_MAX + 1)
+	assert isinstance(bitmap.containers[0], bytearray)
+	assert len(bitmap) == utility.Bitmap.ARRAY_CONTAINER_MAX + 1
+	assert list(bitmap) == list(range(0, 2 * utility.Bitmap.ARRAY_CONTAINER_MAX, 2)) + [2 * utility.Bitmap.ARRAY_CONTAINER_MAX + 1]
+	assert 2 * utility.Bitmap.ARRAY_CONTAINER_MAX + 1 in bitmap and 1 not in bitmap
+
+def test_bitmap_union_and_intersection_match_sets():
+	rng = random.Random(0)
+	# Sparse and dense samples in two containers cover array/array, array/bitset and bitset/bitset pairs
+	samples = [set(rng.sample(range(1 << 17), size)) for size in (50, 3000, 12000, 40000)]
+	for a in samples:
+		for b in samples:
+			assert list(utility.Bitmap(a) | utility.Bitmap(b)) == sorted(a | b)
+			assert list(utility.Bitmap(a) & utility.Bitmap(b)) == sorted(a & b)
+
+def test_bitmap_sparse_bitset_intersection_becomes_array():
+	evens = utility.Bitmap(range(0, 10000, 2))
+	low_range = utility.Bitmap(range(5000))
+	assert isinstance((evens & low_range).containers[0], array)
+	assert list(evens & low_range) == list(range(0, 5000, 2))
+
+def test_build_filter_indexes_indexes_list_values_per_element():
+	filter_indexes, date_column = index.build_filter_indexes(METADATA)
+	assert list(filter_indexes['areaoflaw']['tort']) == [1, 3]
+	assert list(filter_indexes['areaoflaw']['contract law']) == [1, 2]
+	assert list(filter_indexes['areaoflaw']['criminal law']) == [5]
+	assert list(filter_indexes['court']['sg high court']) == [2, 3]
+	assert date_column[1] == [1, 2, 3, 4]
+
+def test_date_range_bitmap(monkeypatch):
+	setup_filters(monkeypatch)
+	assert list(search.get_date_range_bitmap('2015')) == [2, 3]
+	assert list(search.get_date_range_bitmap('2015-01')) == [2]
+	assert list(search.get_date_range_bitmap('..2015-01')) == [1, 2]
+	assert list(search.get_date_range_bitmap('2015-06..')) == [3, 4]
+	assert list(search.get_date_range_bitmap('2014..2015')) == [1, 2, 3]
+	assert list(search.get_date_range_bitmap('2017..')) == []
+
+def test_split_filter_clauses():
+	phrases, clauses = search.split_filter_clauses('intentional tort AND court: "SG High Court" AND date:2015..2016'.split('AND'))
+	assert phrases == ['intentional tort ']
+	assert clauses == [('court', 'SG High Court'), ('date', '2015..2016')]
+
+def test_doc_filter_unions_within_field_and_intersects_across_fields(monkeypatch):
+	setup_filters(monkeypatch)
+	assert search.build_doc_filter([]) is None
+	assert list(search.build_doc_filter([('areaoflaw', 'tort'), ('areaoflaw', 'criminal law')])) == [1, 3, 5]
+	assert list(search.build_doc_filter([('areaoflaw', 'tort'), ('court', ' sg HIGH court ')])) == [3]
+	assert list(search.build_doc_filter([('areaoflaw', 'tort'), ('areaoflaw', 'contract law'), ('date', '2015')])) == [2, 3]
+	assert list(search.build_doc_filter([('court', 'unknown court'), ('areaoflaw', 'tort')])) == []
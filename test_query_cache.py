@@ -0,0 +1,81 @@
+import pickle
+import search
+import utility
+from utility import ScoreDocIDPair
+
+# Document contents for the boolean re-sort, keyed by document ID
+DOCS = {
+	1: 'the intentional tort of battery',
+	2: 'Intentional Tort and Loss of Self-Control',
+	3: 'intentional tort and loss of self-control',
+	4: 'negligence',
+}
+
+def evaluate(query):
+	""" Stand-in for handle_boolean_query that re-sorts a fixed ranking by the raw query phrases """
+	phrases, clauses = search.split_filter_clauses(query.split('AND'))
+	ranking = [ScoreDocIDPair(-score, doc_id) for doc_id, score in [(4, 0.9), (1, 0.8), (2, 0.7), (3, 0.6)]]
+	return map(lambda x: x.doc_id, search.sort_by_boolean_query(ranking, phrases))
+
+def setup_search(monkeypatch, query_cache):
+	monkeypatch.setattr(search, 'preprocess', lambda line: line.lower().split())
+	monkeypatch.setattr(search, 'have_all_keywords', lambda doc_id, keywords: int(all(keyword in DOCS[doc_id] for keyword in keywords)))
+	monkeypatch.setattr(search, 'handle_boolean_query', evaluate)
+	monkeypatch.setattr(search, 'query_cache', query_cache)
+
+def test_cache_hit_matches_uncached_run(monkeypatch):
+	queries = ['intentional tort AND loss of self-control', 'Intentional Tort AND Loss of Self-Control', 'intentional tort AND loss of self-control']
+
+	setup_search(monkeypatch, None)
+	uncached = [search.handle_query(query) for query in queries]
+	assert uncached[0] != uncached[1]
+
+	query_cache = utility.QueryCache('version')
+	setup_search(monkeypatch, query_cache)
+	cached = [search.handle_query(query) for query in queries]
+	assert cached == uncached
+	assert query_cache.hits == 1 and query_cache.misses == 2
+
+def test_cache_key_ignores_surrounding_quotes_and_spaces(monkeypatch):
+	setup_search(monkeypatch, None)
+	assert search.get_query_cache_key(['"intentional tort" '], []) == search.get_query_cache_key([' intentional tort'], [])
+
+def test_cache_lru_eviction():
+	query_cache = utility.QueryCache('version', max_size=2)
+	query_cache.put('a', [1])
+	query_cache.put('b', [2])
+	query_cache.get('a')
+	query_cache.put('c', [3])
+	assert query_cache.get('b') is None
+	assert query_cache.get('a') == [1] and query_cache.get('c') == [3]
+
+def test_cache_discarded_for_other_index_version(tmp_path):
+	path = str(tmp_path / 'query_cache.tmp')
+	query_cache = utility.QueryCache('old')
+	query_cache.put('a', [1])
+	query_cache.save(path)
+	assert utility.QueryCache.load(path, 'old').get('a') == [1]
+	assert utility.QueryCache.load(path, 'new').get('a') is None
+
+def test_unreadable_cache_file_is_a_miss(tmp_path):
+	path = tmp_path / 'query_cache.tmp'
+	# Truncated data, a class from a module that no longer exists and an object of another type
+	for content in [b'\x80\x04', b'cmissing_module\nQueryCache\n.', pickle.dumps({'a': [1]})]:
+		path.write_bytes(content)
+		query_cache = utility.QueryCache.load(str(path), 'version')
+		assert query_cache.index_version == 'version' and not query_cache.entries
+
+def test_results_truncated_by_latency_budget_not_cached(monkeypatch):
+	def truncated_evaluate(query):
+		monkeypatch.setattr(search, 'query_truncated', True)
+		return evaluate(query)
+
+	query_cache = utility.QueryCache('version')
+	setup_search(monkeypatch, query_cache)
+	monkeypatch.setattr(search, 'handle_boolean_query', truncated_evaluate)
+	search.handle_query('intentional tort')
+	assert not query_cache.entries
+
+	monkeypatch.setattr(search, 'handle_boolean_query', evaluate)
+	search.handle_query('intentional tort')
+	assert len(query_cache.entries) == 1
@@ -0,0 +1,110 @@
+import math
+import os
+import pytest
+import random
+import search
+import time
+import utility
+from test_reorder import DOCUMENTS_PATH, STOPWORDS_PATH, get_nltk_env, run_index
+
+# idf is 1 for tort, log10(2) for damag and 0 for court over 10 documents
+DICTIONARY = {
+	'tort': {'df': 1, 'max_tf': 3},
+	'damag': {'df': 5, 'max_tf': 1},
+	'court': {'df': 10, 'max_tf': 2},
+}
+LENGTHS = {doc_id: 1 for doc_id in range(10)}
+POSTINGS = {
+	'tort': [(0, 3)],
+	'damag': [(0, 1), (1, 1), (2, 1), (3, 1), (4, 1)],
+	'court': [(doc_id, 2) for doc_id in range(10)],
+}
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+	""" Index the fixture documents and load the index into the search module """
+	pytest.importorskip('nltk')
+	run_index(str(tmp_path), get_nltk_env(tmp_path), [])
+	with open(STOPWORDS_PATH) as f:
+		monkeypatch.setitem(utility.nlp_resources, 'stopwords', set(f.read().split()))
+	with open(str(tmp_path / 'dictionary.txt'), 'rb') as f:
+		unigram_dict, bigram_dict = search.load_dicts(f)
+	with open(str(tmp_path / 'lengths.txt'), 'rb') as f:
+		unigram_lengths = utility.load_object(f)
+		bigram_lengths = utility.load_object(f)
+	postings_file = open(str(tmp_path / 'postings.txt'), 'rb')
+	for name, value in [('dir_doc', DOCUMENTS_PATH), ('fast_tokenizer', True), ('postings_file', postings_file),
+			('unigram_dict', unigram_dict), ('bigram_dict', bigram_dict), ('unigram_lengths', unigram_lengths), ('bigram_lengths', bigram_lengths)]:
+		# dir_doc and postings_file are only set when search.py runs as a script
+		monkeypatch.setattr(search, name, value, raising=False)
+	yield
+	postings_file.close()
+
+def setup_postings(monkeypatch):
+	read_terms = []
+	def get_posting(term, dictionary):
+		read_terms.append(term)
+		return POSTINGS[term]
+	monkeypatch.setattr(search, 'get_posting', get_posting)
+	return read_terms
+
+def get_brute_force_keyword_scores(doc_ids):
+	""" Score every bigram of the documents by reading its postings, as keyword extraction did before the early exit """
+	combined_doc = ' '.join(utility.extract_doc(os.path.join(DOCUMENTS_PATH, str(doc_id) + '.xml'))['content'] for doc_id in doc_ids)
+	query_ngrams = search.turn_query_into_ngram(search.preprocess(utility.remove_css_text(combined_doc)), 2)
+	scores = {}
+	for term, query_tf in query_ngrams.items():
+		if term in search.bigram_dict:
+			tf_idf = (1 + math.log10(query_tf)) * search.get_idf(term, search.bigram_dict, search.bigram_lengths)
+			posting_doc_ids = set(doc_id for doc_id, doc_tf in search.get_posting(term, search.bigram_dict))
+			scores[term] = tf_idf * len(posting_doc_ids & set(doc_ids)) / search.QUERY_EXPANSION_DOCUMENT_LIMIT
+	return scores
+
+@pytest.mark.parametrize('keyword_limit', [3, 10])
+def test_extract_keywords_matches_brute_force(index, monkeypatch, keyword_limit):
+	monkeypatch.setattr(search, 'QUERY_EXPANSION_KEYWORD_LIMIT', keyword_limit)
+	all_doc_ids = sorted(int(filename[:-len('.xml')]) for filename in os.listdir(DOCUMENTS_PATH))
+	rng = random.Random(0)
+	for i in range(10):
+		doc_ids = sorted(rng.sample(all_doc_ids, rng.randint(1, search.QUERY_EXPANSION_DOCUMENT_LIMIT)))
+		scores = get_brute_force_keyword_scores(doc_ids)
+		keywords = search.extract_keywords_from_docs(doc_ids)
+		# Ties may be broken by a different term, the scores must match
+		assert [scores[keyword] for keyword in keywords] == sorted(scores.values(), reverse=True)[:keyword_limit]
+
+def test_min_idf_drops_low_idf_terms(monkeypatch):
+	query_ngrams = {'tort': 1, 'damag': 2, 'court': 1, 'unknown': 1}
+	monkeypatch.setattr(search, 'QUERY_MIN_IDF', 0.3)
+	query_weights, plan = search.plan_query(query_ngrams, DICTIONARY, LENGTHS)
+	assert [term for term, idf, query_tf_weight in plan] == ['tort', 'damag']
+	# Dropped terms still count towards the query vector length
+	assert len(query_weights) == 3
+
+	monkeypatch.setattr(search, 'QUERY_MIN_IDF', None)
+	query_weights, plan = search.plan_query(query_ngrams, DICTIONARY, LENGTHS)
+	assert [term for term, idf, query_tf_weight in plan] == ['tort', 'damag', 'court']
+
+def test_vsm_after_query_deadline_evaluates_first_planned_term_only(monkeypatch):
+	read_terms = setup_postings(monkeypatch)
+	monkeypatch.setattr(search, 'query_deadline', time.time() - 1)
+	monkeypatch.setattr(search, 'query_truncated', False)
+	result = search.vsm({'tort': 1, 'damag': 1, 'court': 1}, DICTIONARY, LENGTHS)
+	assert read_terms == ['tort']
+	assert [pair.doc_id for pair in result] == [0]
+	assert search.query_truncated
+
+def test_latency_budget_is_shared_by_the_whole_query(monkeypatch):
+	deadlines = []
+	def evaluate(query):
+		deadlines.append(search.query_deadline)
+		time.sleep(0.01)
+		deadlines.append(search.query_deadline)
+		return []
+
+	monkeypatch.setattr(search, 'handle_boolean_query', evaluate)
+	monkeypatch.setattr(search, 'query_cache', None)
+	monkeypatch.setattr(search, 'QUERY_LATENCY_BUDGET', 5)
+	start = time.time()
+	search.handle_query('intentional tort')
+	assert deadlines[0] == deadlines[1]
+	assert start + 5 <= deadlines[0] <= time.time() + 5
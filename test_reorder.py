@@ -0,0 +1,60 @@
+import os
+import pytest
+import shutil
+import subprocess
+import sys
+import utility
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+DOCUMENTS_PATH = os.path.join(SCRIPT_DIR, 'fixtures', 'documents')
+STOPWORDS_PATH = os.path.join(SCRIPT_DIR, 'fixtures', 'stopwords_english.txt')
+QUERIES = [
+	'"intentional tort"',
+	'"remoteness of damage" AND "tort"',
+	'"murder" AND "provocation" AND "loss of self-control"',
+	'"financial assistance" AND "purpose"',
+	'"breach" AND court:"SG High Court"',
+	'"shareholders" AND date:2010..',
+]
+
+def get_nltk_env(tmp_path):
+	""" Environment in which nltk finds the bundled stopword list in place of the nltk stopwords corpus """
+	stopwords_dir = tmp_path / 'nltk_data' / 'corpora' / 'stopwords'
+	stopwords_dir.mkdir(parents=True)
+	shutil.copy(STOPWORDS_PATH, str(stopwords_dir / 'english'))
+	return dict(os.environ, NLTK_DATA=str(tmp_path / 'nltk_data'))
+
+def run_index(work_dir, env, extra_args):
+	""" Index the fixture documents into work_dir """
+	args = [sys.executable, os.path.join(SCRIPT_DIR, 'index.py'), '-i', DOCUMENTS_PATH, '-d', 'dictionary.txt', '-p', 'postings.txt', '-f'] + extra_args
+	subprocess.run(args, cwd=work_dir, env=env, stderr=subprocess.DEVNULL, check=True)
+
+def run_search(work_dir, env, query):
+	""" Search one query against the index in work_dir and return the output document IDs """
+	with open(os.path.join(work_dir, 'query.txt'), 'w') as f:
+		f.write(query + '\n')
+	args = [sys.executable, os.path.join(SCRIPT_DIR, 'search.py'), '-d', 'dictionary.txt', '-p', 'postings.txt', '-q', 'query.txt', '-o', 'output.txt']
+	subprocess.run(args, cwd=work_dir, env=env, stderr=subprocess.DEVNULL, check=True)
+	with open(os.path.join(work_dir, 'output.txt')) as f:
+		return f.read().split()
+
+def test_reordered_doc_ids_give_identical_search_output(tmp_path):
+	pytest.importorskip('nltk')
+	env = get_nltk_env(tmp_path)
+
+	outputs = []
+	for name, extra_args in (('original', []), ('reordered', ['-r'])):
+		work_dir = tmp_path / name
+		work_dir.mkdir()
+		run_index(str(work_dir), env, extra_args)
+		outputs.append([run_search(str(work_dir), env, query) for query in QUERIES])
+
+	original, reordered = outputs
+	assert all(original)
+	# The fixture must actually be reordered for the comparison to mean anything
+	with open(str(tmp_path / 'reordered' / 'docids.txt'), 'rb') as f:
+		original_doc_ids = utility.load_object(f)
+	assert original_doc_ids != sorted(original_doc_ids)
+	assert reordered == original
+	# Output uses the document IDs of the fixture filenames, not the reassigned ones
+	assert set(doc_id for output in reordered for doc_id in output) <= set(filename[:-len('.xml')] for filename in os.listdir(DOCUMENTS_PATH))
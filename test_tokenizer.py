@@ -0,0 +1,78 @@
+import os
+import pytest
+import tokenizer_drift
+import utility
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'tokenizer_sample.xml')
+# Copy of the nltk English stopword list, so the stopword and stemming checks run without the nltk data
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'stopwords_english.txt')
+# Each token missed by the fast tokenizer also breaks the two bigrams around it
+MAX_BIGRAM_DRIFT = 2 * tokenizer_drift.MAX_DRIFT
+MAX_BIGRAM_VOCABULARY_DRIFT = 2 * tokenizer_drift.MAX_VOCABULARY_DRIFT
+
+@pytest.fixture
+def stopwords(monkeypatch):
+	""" Use the bundled stopword list instead of the nltk stopwords corpus """
+	with open(STOPWORDS_PATH) as f:
+		stopword_set = set(f.read().split())
+	monkeypatch.setitem(utility.nlp_resources, 'stopwords', stopword_set)
+	return stopword_set
+
+@pytest.fixture
+def content(stopwords):
+	""" Fixture document content, skipping when the nltk pipeline cannot run """
+	pytest.importorskip('nltk')
+	content = utility.remove_css_text(utility.extract_doc(FIXTURE_PATH)['content'])
+	try:
+		tokenizer_drift.nltk_terms(content)
+	except LookupError:
+		pytest.skip('nltk punkt data unavailable')
+	return content
+
+def assert_symmetric_drift(counts, fast_counts, max_drift, max_vocabulary_drift):
+	""" Neither tokenizer may miss or add more than max_drift of the occurrences or of the vocabulary """
+	assert tokenizer_drift.get_drift(counts, fast_counts) <= max_drift
+	assert tokenizer_drift.get_drift(fast_counts, counts) <= max_drift
+	assert tokenizer_drift.get_vocabulary_drift(counts, fast_counts) <= max_vocabulary_drift
+
+def test_count_unigrams_bigrams_matches_ngram_pipeline():
+	tokens = ['intent', 'tort', 'remot', 'damag', 'intent', 'tort']
+	unigrams, bigrams = utility.count_unigrams_bigrams(iter(tokens))
+	assert unigrams == utility.count_tokens(utility.generate_ngrams(tokens, 1))
+	assert bigrams == utility.count_tokens(utility.generate_ngrams(tokens, 2))
+
+def test_count_unigrams_bigrams_empty():
+	unigrams, bigrams = utility.count_unigrams_bigrams(iter([]))
+	assert not unigrams and not bigrams
+
+def test_drift_penalizes_extra_terms():
+	counts = utility.count_tokens(['tort', 'damag', 'tort'])
+	fast_counts = utility.count_tokens(['tort', 'damag', 'tort', 'junk', 'junk'])
+	assert tokenizer_drift.get_drift(counts, fast_counts) == 0
+	assert tokenizer_drift.get_drift(fast_counts, counts) == 2 / 5
+	assert tokenizer_drift.get_vocabulary_drift(counts, fast_counts) == pytest.approx(1 / 3)
+
+def test_fast_preprocess_matches_staged_stopwords_and_stemming(stopwords):
+	porter = pytest.importorskip('nltk.stem.porter')
+	content = utility.remove_css_text(utility.extract_doc(FIXTURE_PATH)['content'])
+	stemmer = porter.PorterStemmer()
+	tokens = utility.remove_punctuations(utility.token_regex.findall(content.lower()))
+	staged = [stemmer.stem(token) for token in tokens if token not in stopwords]
+	fast = list(utility.fast_preprocess(content))
+	assert fast == staged
+	assert_symmetric_drift(utility.count_tokens(staged), utility.count_tokens(fast), 0, 0)
+
+def test_fast_preprocess_unigram_drift(content):
+	nltk_unigrams = utility.count_tokens(tokenizer_drift.nltk_terms(content))
+	fast_unigrams, fast_bigrams = utility.count_unigrams_bigrams(utility.fast_preprocess(content))
+	assert_symmetric_drift(nltk_unigrams, fast_unigrams, tokenizer_drift.MAX_DRIFT, tokenizer_drift.MAX_VOCABULARY_DRIFT)
+
+def test_fast_preprocess_bigram_drift(content):
+	nltk_bigrams = utility.count_tokens(utility.generate_ngrams(tokenizer_drift.nltk_terms(content), 2))
+	fast_unigrams, fast_bigrams = utility.count_unigrams_bigrams(utility.fast_preprocess(content))
+	assert_symmetric_drift(nltk_bigrams, fast_bigrams, MAX_BIGRAM_DRIFT, MAX_BIGRAM_VOCABULARY_DRIFT)
+
+def test_stemmer_matches_nltk_porter_stemmer():
+	porter = pytest.importorskip('nltk.stem.porter')
+	tokens = utility.token_regex.findall(utility.extract_doc(FIXTURE_PATH)['content'].lower())
+	assert utility.stem(tokens) == [porter.PorterStemmer().stem(token) for token in tokens]
@@ -0,0 +1,119 @@
+import collections
+import getopt
+import os
+import sys
+import time
+import utility
+
+# Maximum tolerated share of term occurrences of one tokenizer that the other never produces, checked both ways
+MAX_DRIFT = 0.05
+# Maximum tolerated share of the combined vocabulary that only one tokenizer produces
+MAX_VOCABULARY_DRIFT = 0.10
+# Number of differing terms listed for each tokenizer
+TOP_TERMS = 20
+
+def nltk_terms(content):
+	""" Preprocess content with the nltk pipeline used by index.py by default """
+	tokens = utility.tokenize(content)
+	tokens = utility.remove_punctuations(tokens)
+	tokens = utility.remove_stopwords(tokens)
+	return utility.stem(tokens)
+
+def fast_terms(content):
+	""" Preprocess content with the fused single-pass tokenizer """
+	return list(utility.fast_preprocess(content))
+
+def get_drift(counts, other_counts):
+	""" Share of term occurrences in counts whose term other_counts never contains """
+	total = sum(counts.values())
+	missed = sum(freq for term, freq in counts.items() if term not in other_counts)
+	return missed / total if total else 0
+
+def get_vocabulary_drift(counts, other_counts):
+	""" Share of the combined vocabulary found in only one of counts and other_counts, 1 - overlap / union """
+	vocabulary = set(counts)
+	other_vocabulary = set(other_counts)
+	union = vocabulary | other_vocabulary
+	return 1 - len(vocabulary & other_vocabulary) / len(union) if union else 0
+
+def report_only(name, counts, other_vocabulary):
+	""" Print the most frequent terms produced by one tokenizer only """
+	only = collections.Counter({term: freq for term, freq in counts.items() if term not in other_vocabulary})
+	print('Only in {} ({:,} terms, {:,} occurrences):'.format(name, len(only), sum(only.values())))
+	for term, freq in only.most_common(TOP_TERMS):
+		print('  {!r}: {:,}'.format(term, freq))
+
+def main():
+	filenames = sorted(filename for filename in os.listdir(dir_doc) if filename.endswith('.xml'))
+	if doc_limit is not None:
+		filenames = filenames[:doc_limit]
+
+	nltk_counts = collections.Counter()
+	fast_counts = collections.Counter()
+	nltk_time = fast_time = 0
+	for filename in filenames:
+		content = utility.extract_doc(os.path.join(dir_doc, filename))['content']
+		content = utility.remove_css_text(content)
+
+		start = time.time()
+		nltk_counts.update(nltk_terms(content))
+		nltk_time += time.time() - start
+
+		start = time.time()
+		fast_counts.update(fast_terms(content))
+		fast_time += time.time() - start
+
+	nltk_vocabulary = set(nltk_counts)
+	fast_vocabulary = set(fast_counts)
+	drift = get_vocabulary_drift(nltk_counts, fast_counts)
+	missed_drift = get_drift(nltk_counts, fast_counts)
+	extra_drift = get_drift(fast_counts, nltk_counts)
+
+	print('Documents: {:,}'.format(len(filenames)))
+	print('nltk tokenizer: {:,} terms in {:.2f} seconds'.format(len(nltk_vocabulary), nltk_time))
+	print('fast tokenizer: {:,} terms in {:.2f} seconds'.format(len(fast_vocabulary), fast_time))
+	print('Vocabulary drift: {:.4%}'.format(drift))
+	print('Occurrence-weighted drift, nltk terms missed by fast: {:.4%}'.format(missed_drift))
+	print('Occurrence-weighted drift, fast terms absent from nltk: {:.4%}'.format(extra_drift))
+	report_only('nltk', nltk_counts, fast_vocabulary)
+	report_only('fast', fast_counts, nltk_vocabulary)
+
+	failed = False
+	if max(missed_drift, extra_drift) > max_drift:
+		print('FAIL: occurrence-weighted drift exceeds {:.2%}'.format(max_drift))
+		failed = True
+	if drift > max_vocabulary_drift:
+		print('FAIL: vocabulary drift exceeds {:.2%}'.format(max_vocabulary_drift))
+		failed = True
+	if failed:
+		sys.exit(1)
+	print('PASS')
+
+def usage():
+	print("usage: " + sys.argv[0] + " -i directory-of-documents [-n document-limit] [-t max-drift] [-v max-vocabulary-drift]")
+
+if __name__ == '__main__':
+	dir_doc = doc_limit = None
+	max_drift = MAX_DRIFT
+	max_vocabulary_drift = MAX_VOCABULARY_DRIFT
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'i:n:t:v:')
+	except getopt.GetoptError as err:
+		usage()
+		sys.exit(2)
+	for o, a in opts:
+		if o == '-i':
+			dir_doc = a
+		elif o == '-n':
+			doc_limit = int(a)
+		elif o == '-t':
+			max_drift = float(a)
+		elif o == '-v':
+			max_vocabulary_drift = float(a)
+		else:
+			assert False, "unhandled option"
+	if dir_doc == None:
+		usage()
+		sys.exit(2)
+
+	main()
@@ -1,14 +1,15 @@
 from string import punctuation
-from nltk.tokenize import word_tokenize
-from nltk.stem.wordnet import WordNetLemmatizer
-from nltk.stem.porter import PorterStemmer
-from nltk.corpus import stopwords
-from nltk.util import ngrams
 from collections import Counter
+from collections import OrderedDict
+from array import array
+from bisect import bisect_left
+from itertools import groupby
 import xml.etree.ElementTree
 import pickle
 import json
+import os
 import re
+import time
 
 # Config persistence path
 config_path = 'config.tmp'
@@ -64,16 +65,65 @@ def extract_doc(file_path):
 	return doc
 
 
+# Normalize a metadata value so filter clauses match regardless of case and surrounding whitespace
+def normalize_filter_value(value):
+	return ' '.join(str(value).lower().split())
+
+
 # Preprocessing variables
-stopword_set = set(stopwords.words('english'))
-punctuation_set = set(punctuation)
-wnl = WordNetLemmatizer()
-stemmer = PorterStemmer()
+# NLP resources are loaded on first use, so importing this module and spawning workers stay cheap
+nlp_resources = {}
+
+
+# NLP resource functions
+def get_stopword_set():
+	if 'stopwords' not in nlp_resources:
+		from nltk.corpus import stopwords
+		nlp_resources['stopwords'] = set(stopwords.words('english'))
+	return nlp_resources['stopwords']
+
+
+def get_punctuation_set():
+	if 'punctuation' not in nlp_resources:
+		nlp_resources['punctuation'] = set(punctuation)
+	return nlp_resources['punctuation']
+
+
+def get_stemmer():
+	if 'stemmer' not in nlp_resources:
+		from nltk.stem.porter import PorterStemmer
+		nlp_resources['stemmer'] = PorterStemmer()
+	return nlp_resources['stemmer']
+
+
+def get_lemmatizer():
+	if 'lemmatizer' not in nlp_resources:
+		from nltk.stem.wordnet import WordNetLemmatizer
+		nlp_resources['lemmatizer'] = WordNetLemmatizer()
+	return nlp_resources['lemmatizer']
+
+
+def get_word_tokenize():
+	if 'word_tokenize' not in nlp_resources:
+		from nltk.tokenize import word_tokenize
+		nlp_resources['word_tokenize'] = word_tokenize
+	return nlp_resources['word_tokenize']
+
+
+# Save the stopword and punctuation sets alongside the index, so searching does not load the nltk corpus
+def save_nlp_snapshot(path):
+	with open(path, 'wb') as f:
+		save_object((get_stopword_set(), get_punctuation_set()), f)
+
+
+def load_nlp_snapshot(path):
+	with open(path, 'rb') as f:
+		nlp_resources['stopwords'], nlp_resources['punctuation'] = load_object(f)
 
 
 # Preprocessing functions, in order of application
 def tokenize(string):
-	return word_tokenize(string.lower())
+	return get_word_tokenize()(string.lower())
 
 
 def remove_css_text(string):
@@ -81,31 +131,74 @@ def remove_css_text(string):
 
 
 def remove_punctuations(tokens):
+	punctuation_set = get_punctuation_set()
 	return [token for token in tokens if token not in punctuation_set]
 
 
 def remove_stopwords(tokens):
+	stopword_set = get_stopword_set()
 	return [token for token in tokens if token not in stopword_set]
 
 
 def lemmatize(tokens):
-	return [wnl.lemmatize(token) for token in tokens]
+	lemmatizer = get_lemmatizer()
+	return [lemmatizer.lemmatize(token) for token in tokens]
 
 
 def stem(tokens):
+	stemmer = get_stemmer()
 	return [stemmer.stem(token) for token in tokens]
 
 
 def generate_ngrams(tokens, n, pad=False, start_sym='<s>', end_sym='</s>'):
 	if n == 1:
 		return tokens
-	return [' '.join(ngram) for ngram in ngrams(tokens, n, pad_left=pad, pad_right=pad, left_pad_symbol=start_sym, right_pad_symbol=end_sym)]
+	if pad:
+		tokens = [start_sym] * (n - 1) + list(tokens) + [end_sym] * (n - 1)
+	return [' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
 
 
 def count_tokens(tokens):
 	return Counter(tokens)
 
 
+# Fast preprocessing variables
+# Approximates word_tokenize: runs of word characters joined by inner hyphens or periods,
+# with n't and clitics such as 's split off as separate tokens and numbers keeping their separators
+token_regex = re.compile(r"\w+?(?=n't\b)|n't\b|'\w+|\d+(?:[,.]\d+)+|\w+(?:[-.]\w+)*")
+stem_cache = {}
+
+
+# Fast preprocessing functions
+# Single streaming pass equivalent to tokenize, remove_punctuations, remove_stopwords and stem.
+# Yields stemmed tokens lazily, stems are memoized as the vocabulary is much smaller than the token stream.
+def fast_preprocess(string):
+	stopword_set = get_stopword_set()
+	stemmer = get_stemmer()
+	for match in token_regex.finditer(string.lower()):
+		token = match.group()
+		if token in stopword_set:
+			continue
+		stemmed = stem_cache.get(token)
+		if stemmed is None:
+			stemmed = stem_cache[token] = stemmer.stem(token)
+		yield stemmed
+
+
+# Count unigrams and bigrams of a token stream in one pass, equivalent to
+# count_tokens(generate_ngrams(tokens, n)) for n = 1 and n = 2
+def count_unigrams_bigrams(tokens):
+	unigrams = Counter()
+	bigrams = Counter()
+	previous = None
+	for token in tokens:
+		unigrams[token] += 1
+		if previous is not None:
+			bigrams[previous + ' ' + token] += 1
+		previous = token
+	return unigrams, bigrams
+
+
 # Object handling functions
 def save_object(obj, f):
 	s_obj = pickle.dumps(obj)
@@ -164,3 +257,228 @@ class ScoreTermPair(object):
 
 	def __hash__(self):
 		return hash(self.term)
+
+
+# Compressed document ID set in the style of a roaring bitmap, used for metadata filter indexes.
+# Document IDs are split into a 16-bit high part selecting a container and a 16-bit low part stored in it.
+# Sparse containers are sorted arrays of low parts, dense containers are 8KB bit arrays.
+class Bitmap(object):
+	ARRAY_CONTAINER_MAX = 4096
+	BITSET_BYTES = 8192
+
+	def __init__(self, doc_ids=()):
+		self.containers = {}
+		for doc_id in doc_ids:
+			self.add(doc_id)
+
+	# Build a bitmap from ascending document IDs one container at a time
+	@classmethod
+	def from_sorted(cls, doc_ids):
+		bitmap = cls()
+		for high, group in groupby(doc_ids, lambda doc_id: doc_id >> 16):
+			bitmap.containers[high] = Bitmap.make_container([doc_id & 0xFFFF for doc_id in group])
+		return bitmap
+
+	# Given ascending low parts, return an array container or a bitset container if there are too many
+	@staticmethod
+	def make_container(lows):
+		if len(lows) <= Bitmap.ARRAY_CONTAINER_MAX:
+			return array('H', lows)
+		bitset = bytearray(Bitmap.BITSET_BYTES)
+		for low in lows:
+			bitset[low >> 3] |= 1 << (low & 7)
+		return bitset
+
+	@staticmethod
+	def container_values(container):
+		if isinstance(container, array):
+			return container
+		return [(i << 3) | bit for i, byte in enumerate(container) if byte for bit in range(8) if byte & (1 << bit)]
+
+	# Bitset containers are combined as one integer each, so AND and OR run a machine word at a time
+	@staticmethod
+	def bitset_to_int(bitset):
+		return int.from_bytes(bitset, 'little')
+
+	@staticmethod
+	def int_to_bitset(bits):
+		return bytearray(bits.to_bytes(Bitmap.BITSET_BYTES, 'little'))
+
+	@staticmethod
+	def union_containers(a, b):
+		if isinstance(a, array) and isinstance(b, array):
+			# Merge of two sorted arrays
+			lows = []
+			i = j = 0
+			while i < len(a) and j < len(b):
+				if a[i] < b[j]:
+					lows.append(a[i])
+					i += 1
+				elif a[i] > b[j]:
+					lows.append(b[j])
+					j += 1
+				else:
+					lows.append(a[i])
+					i += 1
+					j += 1
+			lows.extend(a[i:])
+			lows.extend(b[j:])
+			return Bitmap.make_container(lows)
+		if isinstance(a, array):
+			a, b = b, a
+		if isinstance(b, array):
+			bitset = bytearray(a)
+			for low in b:
+				bitset[low >> 3] |= 1 << (low & 7)
+			return bitset
+		return Bitmap.int_to_bitset(Bitmap.bitset_to_int(a) | Bitmap.bitset_to_int(b))
+
+	@staticmethod
+	def intersect_containers(a, b):
+		if isinstance(a, array) and isinstance(b, array):
+			# Merge of two sorted arrays keeping the common values
+			lows = array('H')
+			i = j = 0
+			while i < len(a) and j < len(b):
+				if a[i] < b[j]:
+					i += 1
+				elif a[i] > b[j]:
+					j += 1
+				else:
+					lows.append(a[i])
+					i += 1
+					j += 1
+			return lows
+		if isinstance(a, array):
+			a, b = b, a
+		if isinstance(b, array):
+			return array('H', [low for low in b if a[low >> 3] & (1 << (low & 7))])
+		bits = Bitmap.bitset_to_int(a) & Bitmap.bitset_to_int(b)
+		bitset = Bitmap.int_to_bitset(bits)
+		# Sparse intersections go back to an array container
+		if bin(bits).count('1') <= Bitmap.ARRAY_CONTAINER_MAX:
+			return array('H', Bitmap.container_values(bitset))
+		return bitset
+
+	def add(self, doc_id):
+		high, low = doc_id >> 16, doc_id & 0xFFFF
+		container = self.containers.get(high)
+		if container is None:
+			container = self.containers[high] = array('H')
+		if isinstance(container, array):
+			# Fast path for document IDs added in ascending order
+			if not container or low > container[-1]:
+				container.append(low)
+			else:
+				i = bisect_left(container, low)
+				if container[i] == low:
+					return
+				container.insert(i, low)
+			if len(container) > Bitmap.ARRAY_CONTAINER_MAX:
+				self.containers[high] = Bitmap.make_container(container)
+		else:
+			container[low >> 3] |= 1 << (low & 7)
+
+	def __contains__(self, doc_id):
+		container = self.containers.get(doc_id >> 16)
+		if container is None:
+			return False
+		low = doc_id & 0xFFFF
+		if isinstance(container, array):
+			i = bisect_left(container, low)
+			return i < len(container) and container[i] == low
+		return bool(container[low >> 3] & (1 << (low & 7)))
+
+	def __iter__(self):
+		for high in sorted(self.containers):
+			for low in Bitmap.container_values(self.containers[high]):
+				yield (high << 16) | low
+
+	def __len__(self):
+		return sum(len(container) if isinstance(container, array) else sum(bin(byte).count('1') for byte in container) for container in self.containers.values())
+
+	def __or__(self, other):
+		bitmap = Bitmap()
+		for high in self.containers.keys() | other.containers.keys():
+			if high not in other.containers:
+				bitmap.containers[high] = self.containers[high][:]
+			elif high not in self.containers:
+				bitmap.containers[high] = other.containers[high][:]
+			else:
+				bitmap.containers[high] = Bitmap.union_containers(self.containers[high], other.containers[high])
+		return bitmap
+
+	def __and__(self, other):
+		bitmap = Bitmap()
+		for high in self.containers.keys() & other.containers.keys():
+			container = Bitmap.intersect_containers(self.containers[high], other.containers[high])
+			if container:
+				bitmap.containers[high] = container
+		return bitmap
+
+	def __repr__(self):
+		return 'Bitmap(%s documents in %s containers)' % (len(self), len(self.containers))
+
+
+# Bounded cache of query results with LRU eviction and an optional time-to-live in seconds.
+# Entries are only valid for the index version they were computed on, a cache loaded against
+# a different index version starts empty. Hit and miss counters are kept across persistence.
+class QueryCache(object):
+	def __init__(self, index_version, max_size=1000, ttl=None):
+		self.index_version = index_version
+		self.max_size = max_size
+		self.ttl = ttl
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is not None:
+			result, timestamp = entry
+			if self.ttl is None or time.time() - timestamp <= self.ttl:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return result
+			del self.entries[key]
+		self.misses += 1
+		return None
+
+	def put(self, key, result):
+		self.entries[key] = (result, time.time())
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.max_size:
+			self.entries.popitem(last=False)
+
+	def clear(self):
+		self.entries.clear()
+
+	@property
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups else 0.0
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			save_object(self, f)
+
+	@staticmethod
+	def load(path, index_version, max_size=1000, ttl=None):
+		cache = None
+		if path is not None and os.path.isfile(path):
+			try:
+				with open(path, 'rb') as f:
+					cache = load_object(f)
+			except Exception:
+				# A corrupt or stale cache file from an older version of this module is a cache miss
+				cache = None
+		if not isinstance(cache, QueryCache) or cache.index_version != index_version:
+			return QueryCache(index_version, max_size, ttl)
+		cache.max_size = max_size
+		cache.ttl = ttl
+		while len(cache.entries) > max_size:
+			cache.entries.popitem(last=False)
+		return cache
+
+	def __repr__(self):
+		return 'QueryCache(%s entries, %s hits, %s misses, %.2f%% hit rate)' % (len(self.entries), self.hits, self.misses, 100 * self.hit_rate)